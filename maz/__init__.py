@@ -1,9 +1,35 @@
-import inspect
-import functools
+from __future__ import annotations
+
 import typing
+import functools
 import operator
 import itertools
 
+# `inspect` is comparatively expensive to import and only needed by
+# `partialpos`, so it is imported there on first use.
+
+# When false, `compose` strips `maz.compositions.named` labels from its
+# functions such that labeling stages costs nothing. Set to true before
+# composing to keep labels for profiling and error messages.
+instrumentation = False
+
+_submodules = frozenset({"compositions", "graph", "tools"})
+
+def __getattr__(name: str):
+
+    """
+        Lazily imports maz submodules on first attribute access (PEP 562),
+        such that e.g. `maz.tools` works without importing it explicitly.
+    """
+
+    if name in _submodules:
+        import importlib
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()).union(_submodules))
+
 # functional composition functions
 def sorted_pos(iterable, key=None) -> typing.Iterable:
 
@@ -20,6 +46,129 @@ def sorted_pos(iterable, key=None) -> typing.Iterable:
     return sorted(iterable, key=key)
 
 
+def merge_sorted(iterables: list, key=None) -> typing.Iterable:
+
+    """
+        Lazily merges already sorted `iterables` into one sorted iterator,
+        as such -> heapq.merge(*iterables, key=key). Only one item from each
+        iterable is held in memory at a time.
+
+        Example:
+            >>> list(merge_sorted([[1, 3, 5], [2, 4]]))
+            [1, 2, 3, 4, 5]
+
+        Return:
+            iterable
+    """
+
+    import heapq
+    return heapq.merge(*iterables, key=key)
+
+
+def topk(iterable, k: int, key=None, reverse: bool = False) -> list:
+
+    """
+        Returns the `k` first items of `iterable` when sorted, equal
+        to sorted(iterable, key=key, reverse=reverse)[:k], but only
+        keeping `k` items in memory.
+
+        Example:
+            >>> topk([5, 1, 4, 2], 2)
+            [1, 2]
+            >>> topk([5, 1, 4, 2], 2, reverse=True)
+            [5, 4]
+
+        Return:
+            list
+    """
+
+    import heapq
+    if reverse:
+        return heapq.nlargest(k, iterable, key=key)
+    return heapq.nsmallest(k, iterable, key=key)
+
+
+def external_sorted(iterable, key=None, buffer_size: int = 100000, fan_in: int = 64) -> typing.Iterable:
+
+    """
+        Sorts `iterable` without holding it all in memory. Items are read
+        in runs of at most `buffer_size` items, each run is sorted and
+        spilled to a temporary file and finally all runs are lazily merged.
+        At most `fan_in` runs are merged at a time, runs beyond that are
+        first merged into larger runs, such that at most about `fan_in`
+        files per level of merging are open at once. The result is equal
+        to sorted(iterable, key=key). Items must be picklable.
+
+        Example:
+            >>> list(external_sorted([3, 1, 2], buffer_size=2))
+            [1, 2, 3]
+
+        Return:
+            iterable
+    """
+
+    if buffer_size < 1:
+        raise ValueError(f"`buffer_size` must be greater or equal to 1, got {buffer_size}")
+    if fan_in < 2:
+        raise ValueError(f"`fan_in` must be greater or equal to 2, got {fan_in}")
+
+    return _external_sorted(iter(iterable), key, buffer_size, fan_in)
+
+
+def _external_sorted(iterator, key, buffer_size: int, fan_in: int):
+
+    import heapq
+    import pickle
+    import tempfile
+
+    def spill(run):
+        file = tempfile.TemporaryFile()
+        pickler = pickle.Pickler(file, protocol=pickle.HIGHEST_PROTOCOL)
+        for item in run:
+            pickler.dump(item)
+            # avoid the pickler memoizing every item written to the run
+            pickler.clear_memo()
+        file.seek(0)
+        return file
+
+    def load(file):
+        unpickler = pickle.Unpickler(file)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+    def merge(start, stop):
+        # merges the consecutive runs files[start:stop] into one, keeping the sort stable
+        merged = spill(heapq.merge(*map(load, files[start:stop]), key=key))
+        for file in files[start:stop]:
+            file.close()
+        files[start:stop] = [merged]
+        levels[start:stop] = [levels[start] + 1]
+
+    # runs in input order, and for each how many times it has been merged
+    files = []
+    levels = []
+    try:
+        while True:
+            run = sorted(itertools.islice(iterator, buffer_size), key=key)
+            if len(run) < buffer_size:
+                break
+            files.append(spill(run))
+            levels.append(0)
+            # as soon as the last `fan_in` runs are of equal level, merge them into one
+            while len(files) >= fan_in and len(set(levels[-fan_in:])) == 1:
+                merge(len(files) - fan_in, len(files))
+
+        while len(files) >= fan_in:
+            merge(0, fan_in)
+        yield from heapq.merge(*map(load, files), run, key=key)
+    finally:
+        for file in files:
+            file.close()
+
+
 def cached_execution(cache: dict, key: str, function: typing.Callable, *args, **kwargs) -> tuple:
     """
         If key is in cache, cache[key] is returned, else
@@ -39,7 +188,10 @@ def cached_execution(cache: dict, key: str, function: typing.Callable, *args, **
             tuple: (cache,)
     """
     if not key in cache:
-        cache[key] = function(*args,**kwargs)
+        # `setdefault` is atomic on a dict, so when called concurrently with
+        # the same key every caller gets the same (first stored) value, even
+        # if `function` happened to be computed more than once.
+        return cache, cache.setdefault(key, function(*args,**kwargs))
 
     return cache, cache[key]
 
@@ -92,24 +244,24 @@ def pospartial(function, positional_arguments):
         return fn(*nargs, **kwargs)
     return wrapper
 
-class partialpos:
+class _partialpos_plan:
 
     """
-        Return a new partial function object which when called behave like
-        `function` called with positional arguments given in `positional_arguments`.
-        Each key `i` corresponds to the `i`'th argument in `function`.
-
+        The signature layout of a function, computed once and shared by
+        all `partialpos` objects binding the same positions of it.
     """
 
-    def __init__(self, function, positional_arguments: typing.Dict[int, typing.Any]):
-        self.function = function
-        self.positional_arguments = positional_arguments
+    __slots__ = ("function", "positions", "varnames", "defaults", "left")
 
-    def _defaults(self) -> dict:
-        return dict(
+    def __init__(self, function, positions: typing.Iterable[int]):
+        import inspect
+        self.function = function
+        self.positions = frozenset(positions)
+        self.varnames = function.__code__.co_varnames
+        self.defaults = dict(
             itertools.starmap(
                 lambda k,v: (
-                    self.function.__code__.co_varnames.index(k), 
+                    self.varnames.index(k),
                     v.default
                 ),
                 filter(
@@ -118,45 +270,133 @@ class partialpos:
                         operator.attrgetter("default"),
                         operator.itemgetter(1),
                     ),
-                    inspect.signature(self.function).parameters.items()
+                    inspect.signature(function).parameters.items()
                 )
             )
         )
+        self.left = sorted(set(range(len(self.varnames))).difference(self.positions))
 
-    def __call__(self, *args, **kwargs):
+    def arguments(self, positional_arguments: dict, args: tuple, kwargs: dict) -> list:
 
         # First we collect function's default arguments,
-        # all positional arguments hard coded in self.positional_arguments
+        # all positional arguments hard coded in positional_arguments
         # and then given from kwargs input. It is also priorized in that order,
         # so if e.g. default value on argument a=1, but user gives a=2 in kwargs,
         # then a=2 is what will be calculated on.
         # Finally will append the positional arguments given from
         # user into function. So the experience will be as if it is
-        # calling any other function. 
+        # calling any other function.
 
-        left = set(range(len(self.function.__code__.co_varnames))).difference(self.positional_arguments.keys())        
-        return self.function(
-            *map(
-                operator.itemgetter(1),
-                sorted(
-                    dict(
-                        itertools.chain(
-                            self._defaults().items(),
-                            self.positional_arguments.items(),
-                            itertools.starmap(
-                                lambda k,v: (
-                                    self.function.__code__.co_varnames.index(k),
-                                    v
-                                ),
-                                kwargs.items(),
-                            ),
-                            zip(left, args)
-                        )
-                    ).items(),
-                    key=operator.itemgetter(0),
-                )
+        arguments = dict(self.defaults)
+        arguments.update(positional_arguments)
+        arguments.update(
+            itertools.starmap(
+                lambda k,v: (self.varnames.index(k), v),
+                kwargs.items(),
             )
         )
+        arguments.update(zip(self.left, args))
+        return list(map(arguments.__getitem__, sorted(arguments)))
+
+
+class partialpos:
+
+    """
+        Return a new partial function object which when called behave like
+        `function` called with positional arguments given in `positional_arguments`.
+        Each key `i` corresponds to the `i`'th argument in `function`.
+
+        The signature of `function` is analyzed on first call, and again only
+        if `function` or the bound positions have changed. Use `partialpos.template` to share
+        that analysis between many objects binding the same positions.
+
+    """
+
+    def __init__(self, function, positional_arguments: typing.Dict[int, typing.Any]):
+        self.function = function
+        self.positional_arguments = positional_arguments
+        self._plan = None
+
+    @staticmethod
+    def template(function, positions: typing.Sequence[int]) -> partialpos_template:
+
+        """
+            Returns a factory of `partialpos` objects binding `positions` of `function`,
+            all sharing one analysis of its signature.
+
+            Example:
+                >>> def add(x, y): return x+y
+                >>> add_to = partialpos.template(add, [1])
+                >>> add_to(2)(3)
+                5
+                >>> add_to.apply_many([(1,), (2,), (3,)], 10)
+                [11, 12, 13]
+        """
+
+        return partialpos_template(function, positions)
+
+    def __call__(self, *args, **kwargs):
+        if (
+            self._plan is None
+            or self._plan.function is not self.function
+            or self._plan.positions != self.positional_arguments.keys()
+        ):
+            self._plan = _partialpos_plan(self.function, self.positional_arguments)
+        return self.function(
+            *self._plan.arguments(self.positional_arguments, args, kwargs)
+        )
+
+
+class partialpos_template:
+
+    """
+        Factory of `partialpos` objects binding `positions` of `function`. See
+        `partialpos.template`.
+    """
+
+    def __init__(self, function, positions: typing.Sequence[int]):
+        self.function = function
+        self.positions = tuple(positions)
+        self.plan = _partialpos_plan(function, self.positions)
+
+    def __call__(self, *values) -> partialpos:
+
+        """
+            Returns a `partialpos` binding `values` to positions, in order.
+        """
+
+        if len(values) != len(self.positions):
+            raise ValueError(f"expected {len(self.positions)} values, got {len(values)}")
+
+        bound = partialpos(self.function, dict(zip(self.positions, values)))
+        bound._plan = self.plan
+        return bound
+
+    def apply_many(self, values: typing.Iterable[tuple], *args, **kwargs) -> list:
+
+        """
+            Returns the results of calling `function` with each tuple in `values`
+            bound to positions, and `args`/`kwargs` as when calling a `partialpos`.
+            Arguments not depending on `values` are laid out only once.
+        """
+
+        plan = self.plan
+        arguments = plan.arguments(dict.fromkeys(self.positions), args, kwargs)
+        # indices into `arguments` where the bound values go, unless overridden by kwargs or args
+        overridden = set(map(plan.varnames.index, kwargs)).union(plan.left[:len(args)])
+        layout = sorted(set(plan.defaults).union(self.positions, overridden))
+        slots = [
+            (layout.index(position), i)
+            for i, position in enumerate(self.positions)
+            if position not in overridden
+        ]
+        results = []
+        for value in values:
+            for slot, i in slots:
+                arguments[slot] = value[i]
+            results.append(self.function(*arguments))
+        return results
+
 
 class compose_pair:
     """
@@ -185,6 +425,20 @@ class compose_pair:
         )
 
 
+def _unlabel(function):
+
+    """
+        Returns the function wrapped by (possibly nested) `maz.compositions.named`
+        labels. If `maz.compositions` was never imported there can't be any labels.
+    """
+
+    import sys
+    compositions = sys.modules.get(f"{__name__}.compositions")
+    while compositions is not None and isinstance(function, compositions.named):
+        function = function.function
+    return function
+
+
 class compose:
 
     """
@@ -206,6 +460,9 @@ class compose:
     """
 
     def __init__(self, *functions):
+        if not instrumentation:
+            functions = tuple(map(_unlabel, functions))
+        self.functions = functions
         self.fn = functools.reduce(compose_pair, functions)
 
     def __call__(self, *args, **kwargs):
@@ -386,37 +643,16 @@ class filter_map_concat:
         self.fmap_function = fmap_function
 
     def __call__(self, objects: typing.Iterable[typing.Any]) -> typing.Iterable[typing.Any]:
-        objects_t, objects_f = itertools.tee(objects)
-        return map(
-            operator.itemgetter(1),
-            sorted(
-                itertools.chain(
-                    map(
-                        lambda x: (x[0], self.tmap_function(x[1])),
-                        filter(
-                            compose(
-                                self.filter_predicate,
-                                operator.itemgetter(1),
-                            ),
-                            enumerate(objects_t)
-                        ),
-                    ),
-                    
-                    map(
-                        lambda x: (x[0], self.fmap_function(x[1])),
-                        filter(
-                            compose(
-                                operator.not_,
-                                self.filter_predicate,
-                                operator.itemgetter(1),
-                            ),
-                            enumerate(objects_f)
-                        ),
-                    )
-                ),
-                key=operator.itemgetter(0),
-            )
+        # A single pass applying each branch through `ifttt` keeps order without
+        # the `itertools.tee` buffer (which is not thread-safe) and without sorting,
+        # and calls `filter_predicate` once per object. All objects are mapped
+        # before returning, such that errors are raised from this call.
+        branch = ifttt(
+            self.filter_predicate,
+            self.tmap_function,
+            self.fmap_function,
         )
+        return iter([branch(x) for x in objects])
 
 class ifttt:
 
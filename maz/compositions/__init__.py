@@ -1,5 +1,14 @@
-from typing import Callable, Any
-from time import sleep
+from __future__ import annotations
+
+import heapq
+import functools
+import operator
+import maz
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import repeat
+from time import perf_counter, sleep, time
+from typing import Callable, Any, Iterable
 
 class retry_until:
 
@@ -40,14 +49,687 @@ class waiting:
         sleep(self.in_seconds)
         return self.function(*args, **kwargs)
 
+class retry_stream:
+
+    """
+        Returns a new generator function yielding the items of the iterable
+        returned by `factory`. If the iterable raises one of `exceptions` midway,
+        it is resumed after the last successfully yielded item by calling
+        `resume(position, *args, **kwargs)`, where `position` is the number of items
+        yielded so far. Without `resume`, `factory` is called again and the
+        first `position` items are skipped.
+
+        Between attempts it waits `backoff` seconds, doubled after each failed
+        attempt without any new item. When `retries` attempts in a row have failed
+        the last exception is raised. If `item_timeout` is given, waiting longer
+        than it for opening the iterable or for an item counts as a failure. If
+        `timeout` is given, a TimeoutError is raised when the whole stream, including
+        opening and skipping, takes longer than it. Time spent by the consumer
+        between items also counts. With any timeout, the iterable is read on a
+        daemon thread, which is left behind if it hangs. When the stream ends,
+        `report(items, seconds)` is called if given.
+
+        Examples
+        --------
+            >>> fn = retry_stream(read_rows, resume=lambda position: read_rows(offset=position))
+            >>> for row in fn():
+            ...     ...
+
+        Returns
+        -------
+            out : Callable[..., Iterator[Any]]
+    """
+
+    def __init__(
+        self,
+        factory: Callable[..., Iterable[Any]],
+        resume: Callable[..., Iterable[Any]] = None,
+        retries: int = 3,
+        backoff: float = 1.0,
+        item_timeout: float = None,
+        timeout: float = None,
+        report: Callable[[int, float], Any] = None,
+        exceptions: tuple = (Exception,),
+    ):
+        if retries < 1:
+            raise ValueError(f"`retries` must be greater or equal to 1, got {retries}")
+
+        self.factory = factory
+        self.resume = resume
+        self.retries = retries
+        self.backoff = backoff
+        self.item_timeout = item_timeout
+        self.timeout = timeout
+        self.report = report
+        self.exceptions = exceptions
+
+    def _remaining(self, deadline: float) -> float:
+        if deadline is None:
+            return None
+        remaining = deadline - perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f"stream did not finish within {self.timeout} seconds")
+        return remaining
+
+    def __call__(self, *args, **kwargs):
+        start = perf_counter()
+        deadline = None if self.timeout is None else start + self.timeout
+        position = 0
+        failures = 0
+        try:
+            while True:
+                # With timeouts, the source is only touched from a worker thread
+                # such that opening, skipping and reading items can all time out.
+                worker = None if self.item_timeout is None and self.timeout is None else _worker()
+                iterator = None
+                hung = False
+
+                def call(function):
+                    nonlocal hung
+                    remaining = self._remaining(deadline)
+                    if worker is None:
+                        return function()
+                    if self.item_timeout is None:
+                        wait = remaining
+                    else:
+                        wait = self.item_timeout if remaining is None else min(self.item_timeout, remaining)
+                    try:
+                        return worker(function, wait)
+                    except _worker.Timeout:
+                        hung = True
+                        self._remaining(deadline)
+                        raise TimeoutError(f"no item within {self.item_timeout} seconds")
+
+                try:
+                    if position == 0:
+                        iterator = call(lambda: iter(self.factory(*args, **kwargs)))
+                    elif self.resume is not None:
+                        iterator = call(lambda: iter(self.resume(position, *args, **kwargs)))
+                    else:
+                        iterator = call(lambda: iter(self.factory(*args, **kwargs)))
+                        for _ in range(position):
+                            call(iterator.__next__)
+                    while True:
+                        item = call(iterator.__next__)
+                        # counted before yielding, since the consumer may stop at any yield
+                        position += 1
+                        failures = 0
+                        yield item
+                except StopIteration:
+                    return
+                except TimeoutError:
+                    if deadline is not None and perf_counter() >= deadline:
+                        raise
+                    failures += 1
+                    if failures >= self.retries:
+                        raise
+                except self.exceptions:
+                    failures += 1
+                    if failures >= self.retries:
+                        raise
+                finally:
+                    # Close the source (e.g. a generator holding a connection) on the
+                    # thread owning it, unless it hangs on that thread. Errors from
+                    # closing are ignored, they would hide why the attempt ended.
+                    if iterator is not None and not hung and hasattr(iterator, "close"):
+                        try:
+                            call(iterator.close)
+                        except Exception:
+                            pass
+                    if worker is not None:
+                        worker.close()
+
+                delay = self.backoff * 2 ** (failures - 1)
+                remaining = self._remaining(deadline)
+                sleep(delay if remaining is None else min(delay, remaining))
+        finally:
+            if self.report is not None:
+                self.report(position, perf_counter() - start)
+
+class _worker:
+
+    """
+        Calls functions one at a time on a daemon thread, such that waiting
+        for a call can time out. A call that never returns leaves its thread
+        behind, but being a daemon it never keeps the process from exiting.
+    """
+
+    class Timeout(Exception):
+        pass
+
+    def __init__(self):
+        import queue
+        import threading
+
+        self.Empty = queue.Empty
+        self.requests = queue.SimpleQueue()
+        self.results = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            function = self.requests.get()
+            if function is None:
+                return
+            try:
+                self.results.put((True, function()))
+            except BaseException as exception:
+                self.results.put((False, exception))
+
+    def __call__(self, function, timeout: float):
+        self.requests.put(function)
+        try:
+            ok, result = self.results.get(timeout=timeout)
+        except self.Empty:
+            raise _worker.Timeout()
+        if ok:
+            return result
+        raise result
+
+    def close(self):
+        self.requests.put(None)
+
+# Stage timings of the innermost running `profile`, if any.
+_stages = ContextVar("maz_stages", default=None)
+
+def _label(exception: BaseException, name: str):
+
+    """
+        Adds a note to `exception` telling it was raised inside stage `name`.
+    """
+
+    note = f"raised in maz stage {name!r}"
+    if hasattr(exception, "add_note"):
+        exception.add_note(note)
+    else:
+        exception.__notes__ = [*getattr(exception, "__notes__", []), note]
+
 class named:
 
     """
-        Returns an object with properties name and function.
+        Returns a new function labeling `function` with `name`. Calling it
+        is as calling `function`, but exceptions raised from inside it get a note
+        with `name` and, when called within `profile`, its time is recorded under `name`.
+
+        A `maz.compose` drops all labels given to it unless `maz.instrumentation`
+        is true when composing, such that labels cost nothing in production.
+
+        Examples
+        --------
+            >>> parse = named("parse", int)
+            >>> parse("3")
+            3
+
+        Returns
+        -------
+            out : Callable
     """
 
-    name: str
-    function: Callable[[Any], Any]
+    def __init__(self, name: str, function: Callable[..., Any]):
+        self.name = name
+        self.function = function
+
+    def __call__(self, *args, **kwargs) -> Any:
+        stages = _stages.get()
+        start = perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        except Exception as exception:
+            _label(exception, self.name)
+            raise
+        finally:
+            if stages is not None:
+                stages.append((self.name, perf_counter() - start))
+
+class profile:
+
+    """
+        Returns a new function calling `function` and also returning the time
+        spent in each `named` stage during the call.
+
+        Examples
+        --------
+            >>> fn = profile(named("inc", lambda x: x+1))
+            >>> result, stages = fn(1)
+            >>> result, [name for name, seconds in stages]
+            (2, ['inc'])
+
+        Returns
+        -------
+            out : Callable[..., tuple]: (result, [(name, seconds), ...])
+    """
+
+    def __init__(self, function: Callable[..., Any]):
+        self.function = function
+
+    def __call__(self, *args, **kwargs) -> tuple:
+        stages = []
+        token = _stages.set(stages)
+        try:
+            return self.function(*args, **kwargs), stages
+        finally:
+            _stages.reset(token)
+
+class _stage:
+
+    """
+        Records the time spent calling `function` under `label` when
+        called within `profile`. As `named`, but leaves exceptions untouched.
+    """
+
+    def __init__(self, label: str, function: Callable[..., Any]):
+        self.label = label
+        self.function = function
+
+    def __call__(self, *args, **kwargs) -> Any:
+        stages = _stages.get()
+        start = perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            if stages is not None:
+                stages.append((self.label, perf_counter() - start))
+
+def _traced(function: Callable[..., Any], path: str = "", name: str = None) -> Callable[..., Any]:
+
+    """
+        Returns an equivalent of `function` where `function` and each function
+        inside of maz combinators (compose, ifttt, fnmap, ...) record their time
+        as stages labeled by their path in the combinator tree, e.g.
+        "compose/1:ifttt/then:inc".
+    """
+
+    if isinstance(function, named):
+        return _traced(function.function, path, name or function.name)
+
+    if name is None:
+        name = getattr(function, "__name__", type(function).__name__)
+    label = f"{path}:{name}" if path else name
+
+    if isinstance(function, maz.compose):
+        traced = functools.reduce(
+            maz.compose_pair,
+            (_traced(fn, f"{label}/{i}") for i, fn in enumerate(function.functions)),
+        )
+    elif isinstance(function, maz.compose_pair):
+        traced = maz.compose_pair(
+            _traced(function.f, f"{label}/f"),
+            _traced(function.g, f"{label}/g"),
+        )
+    elif isinstance(function, maz.ifttt):
+        traced = maz.ifttt(
+            _traced(function.fnif, f"{label}/if"),
+            _traced(function.fnthen, f"{label}/then"),
+            _traced(function.fnelse, f"{label}/else"),
+        )
+    elif isinstance(function, maz.fnexcept):
+        traced = maz.fnexcept(
+            _traced(function.raising_function, f"{label}/try"),
+            _traced(function.handler_function, f"{label}/except"),
+        )
+    elif isinstance(function, maz.fnmap):
+        traced = maz.fnmap(
+            *(_traced(fn, f"{label}/{i}") for i, fn in enumerate(function.functions))
+        )
+    elif isinstance(function, maz.filter_map_concat):
+        traced = maz.filter_map_concat(
+            _traced(function.filter_predicate, f"{label}/filter"),
+            _traced(function.tmap_function, f"{label}/true"),
+            _traced(function.fmap_function, f"{label}/false"),
+        )
+    else:
+        traced = function
+
+    return _stage(label, traced)
+
+class sampled:
+
+    """
+        Returns a new function calling `function`, where a `rate` fraction of
+        all calls are timed. The `capacity` slowest of those are kept together
+        with a truncated repr of their arguments and the time spent in each
+        stage of `function`, and can be fetched with `slowest`.
+
+        Stages are found by walking the maz combinators `function` is built of
+        (compose, ifttt, fnmap, fnexcept, filter_map_concat and named), so leaf
+        functions need no changes. Lazily evaluated results (e.g. from `fnmap`)
+        are only timed as far as they are evaluated within the call.
+
+        Examples
+        --------
+            >>> fn = sampled(maz.compose(inc, double), rate=0.01, capacity=10)
+            >>> fn(3)
+            7
+            >>> fn.slowest()
+            [{"seconds": ..., "args": "(3,)", "kwargs": "{}", "stages": [...], "error": None}, ...]
+
+        Returns
+        -------
+            out : Callable
+    """
+
+    def __init__(self, function: Callable[..., Any], rate: float = 0.01, capacity: int = 10, max_repr: int = 200):
+        import random
+        import reprlib
+        import threading
+
+        if not 0 <= rate <= 1:
+            raise ValueError(f"`rate` must be between 0 and 1, got {rate}")
+        if capacity < 1:
+            raise ValueError(f"`capacity` must be greater or equal to 1, got {capacity}")
+
+        self.function = function
+        self.rate = rate
+        self.capacity = capacity
+        self.max_repr = max_repr
+        self.traced = _traced(function)
+        self.random = random.random
+        self.repr = reprlib.Repr()
+        self.repr.maxstring = self.repr.maxother = max_repr
+        self.lock = threading.Lock()
+        self.calls = []
+        self.count = 0
+
+    def _truncate(self, obj) -> str:
+        text = self.repr.repr(obj)
+        return text if len(text) <= self.max_repr else text[:self.max_repr-3] + "..."
+
+    def _record(self, seconds: float, args: tuple, kwargs: dict, stages: list, error):
+        with self.lock:
+            self.count += 1
+            count = self.count
+            if len(self.calls) == self.capacity and seconds <= self.calls[0][0]:
+                return
+        record = {
+            "seconds": seconds,
+            "args": self._truncate(args),
+            "kwargs": self._truncate(kwargs),
+            "stages": stages,
+            "error": None if error is None else repr(error),
+        }
+        with self.lock:
+            if len(self.calls) < self.capacity:
+                heapq.heappush(self.calls, (seconds, count, record))
+            elif seconds > self.calls[0][0]:
+                heapq.heapreplace(self.calls, (seconds, count, record))
+
+    def __call__(self, *args, **kwargs):
+        if self.random() >= self.rate:
+            return self.function(*args, **kwargs)
+
+        stages = []
+        token = _stages.set(stages)
+        error = None
+        start = perf_counter()
+        try:
+            return self.traced(*args, **kwargs)
+        except BaseException as exception:
+            error = exception
+            raise
+        finally:
+            seconds = perf_counter() - start
+            _stages.reset(token)
+            self._record(seconds, args, kwargs, stages, error)
+
+    def slowest(self) -> list:
+
+        """
+            Returns the slowest sampled calls, slowest first.
+        """
+
+        with self.lock:
+            calls = list(self.calls)
+        return [record for _, _, record in sorted(calls, key=operator.itemgetter(0, 1), reverse=True)]
+
+    def clear(self):
+
+        """
+            Forgets all sampled calls.
+        """
+
+        with self.lock:
+            self.calls.clear()
+
+def _canonical(obj):
+
+    """
+        Returns `obj` with all (nested) sets and dicts replaced by tuples
+        in a canonical order, such that equal objects pickle equally
+        regardless of hash randomization and insertion order.
+    """
+
+    import pickle
+
+    if isinstance(obj, (set, frozenset)):
+        return (type(obj).__name__, tuple(sorted(map(_canonical, obj), key=pickle.dumps)))
+    if isinstance(obj, dict):
+        return (type(obj).__name__, tuple(sorted(map(_canonical, obj.items()), key=pickle.dumps)))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(map(_canonical, obj)))
+    return obj
+
+class persistent_cache:
+
+    """
+        Returns a new function that caches results of `function` in a SQLite
+        database at `path`, such that results survive between processes.
+        Results are keyed by a hash of the pickled arguments together with
+        `version`. Bump `version` whenever the wrapped pipeline changes to
+        stop reusing old results. If `max_entries` is set, the least recently
+        used results are evicted when the cache grows beyond it.
+
+        Sets and dicts in the arguments are put in a canonical order before
+        hashing, such that keys are equal between processes. Other objects are
+        hashed by their pickle, which must be deterministic for them to hit.
+        Keys depend on types, so e.g. `1`, `1.0` and `True` are different keys.
+
+        Examples
+        --------
+            >>> cached_fn = persistent_cache(lambda x: x+1, "cache.db", version="1")
+            >>> cached_fn(1)
+            2
+            >>> list(cached_fn.map([1, 2, 3]))
+            [2, 3, 4]
+
+        Returns
+        -------
+            out : Callable
+    """
+
+    def __init__(self, function, path: str, version: str = "", max_entries: int = None):
+        import sqlite3
+        import threading
+
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"`max_entries` must be greater or equal to 1, got {max_entries}")
+
+        self.function = function
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        # Threads borrow a connection to the database (in WAL mode) for each
+        # access and give it back after, such that cache hits read concurrently.
+        # At most `pool_size` idle connections are kept open, others are closed
+        # when given back. Hits buffer their access times in `accessed`, which
+        # are written when storing results, or by the hit filling the buffer with
+        # 1000 access times. `lock` only guards `idle` and `accessed`, never
+        # database access.
+        self.connect = functools.partial(sqlite3.connect, path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pool_size = 8
+        self.idle = []
+        self.closed = False
+        self.accessed = {}
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+                )
+
+    @contextmanager
+    def _connection(self):
+
+        """
+            Borrows an idle connection, or opens a new one, for the duration
+            of the with-block.
+        """
+
+        with self.lock:
+            if self.closed:
+                raise ValueError("cache is closed")
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            connection = self.connect()
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                if not self.closed and len(self.idle) < self.pool_size:
+                    self.idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def key(self, *args, **kwargs) -> str:
+
+        """
+            Returns the stable cache key for calling with `args` and `kwargs`.
+        """
+
+        import hashlib
+        import pickle
+
+        return hashlib.sha256(
+            pickle.dumps(
+                _canonical((self.version, args, kwargs)),
+                protocol=4,
+            )
+        ).hexdigest()
+
+    def _get(self, keys: list) -> dict:
+        import pickle
+
+        found = {}
+        with self._connection() as connection:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                found.update(
+                    connection.execute(
+                        f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    )
+                )
+            if found:
+                with self.lock:
+                    self.accessed.update(zip(found, repeat(time())))
+                    flush = len(self.accessed) >= 1000
+                if flush:
+                    with connection:
+                        self._flush(connection)
+        return {key: pickle.loads(value) for key, value in found.items()}
+
+    def _flush(self, connection):
+
+        """
+            Writes buffered access times within the transaction of `connection`.
+        """
+
+        with self.lock:
+            accessed, self.accessed = self.accessed, {}
+        connection.executemany(
+            "UPDATE results SET accessed = ? WHERE key = ?",
+            ((accessed_at, key) for key, accessed_at in accessed.items()),
+        )
+
+    def _put(self, items: dict):
+        import pickle
+
+        rows = [(key, pickle.dumps(value), time()) for key, value in items.items()]
+        with self._connection() as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO results (key, value, accessed) VALUES (?, ?, ?)",
+                rows,
+            )
+            # access times must be up to date before evicting the least recently used
+            self._flush(connection)
+            if self.max_entries is not None:
+                count = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.max_entries:
+                    connection.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY accessed LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+
+    def __call__(self, *args, **kwargs):
+        key = self.key(*args, **kwargs)
+        found = self._get([key])
+        if key in found:
+            return found[key]
+
+        result = self.function(*args, **kwargs)
+        self._put({key: result})
+        return result
+
+    def map(self, iterable: Iterable[Any]) -> Iterable[Any]:
+
+        """
+            As built in `map` over the cached function. All cached results are
+            looked up in bulk, missing results are computed and then stored in
+            a single transaction.
+        """
+
+        items = list(iterable)
+        keys = list(map(self.key, items))
+        found = self._get(list(set(keys)))
+        missing = {}
+        for key, item in zip(keys, items):
+            if key not in found and key not in missing:
+                missing[key] = self.function(item)
+        if missing:
+            self._put(missing)
+            found.update(missing)
+        return map(found.__getitem__, keys)
+
+    def warm(self, iterable: Iterable[Any]):
+
+        """
+            Computes and stores results for all items in `iterable` that are
+            not yet cached.
+        """
+
+        self.map(iterable)
+
+    def __len__(self) -> int:
+        with self._connection() as connection:
+            return connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+
+        """
+            Removes all cached results.
+        """
+
+        with self._connection() as connection, connection:
+            connection.execute("DELETE FROM results")
+        with self.lock:
+            self.accessed.clear()
+
+    def close(self):
+
+        """
+            Writes buffered access times and closes all connections.
+        """
 
-    def __call__(self, *args, **kwds) -> Any:
-        return self.function(args, kwds)
+        with self._connection() as connection, connection:
+            self._flush(connection)
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from concurrent.futures import Executor
+from time import perf_counter
+from typing import Callable, Any, Dict, Tuple
+
+def _timed(function, args: tuple) -> tuple:
+
+    """
+        Calls `function` with `args` and returns the result together with
+        the elapsed time in seconds. Module level such that it can be sent
+        to a process pool.
+    """
+
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+class graph:
+
+    """
+        A dataflow graph where each node is a function and each edge is a named
+        data dependency. A node's function is called with the results of its
+        dependencies as positional arguments, in the order they were given.
+        Dependencies not being nodes are inputs to the graph, given when calling it.
+
+        If `executor` (e.g. a `concurrent.futures.ThreadPoolExecutor` or
+        `ProcessPoolExecutor`) is given, each node is submitted as soon as
+        all its dependencies are done, such that independent nodes run
+        concurrently. Otherwise nodes are run one by one on the calling thread.
+
+        Examples
+        --------
+            >>> g = (
+            ...     graph()
+            ...     .node("total", lambda x, y: x+y, "double", "inc")
+            ...     .node("double", lambda x: x*2, "x")
+            ...     .node("inc", lambda x: x+1, "x")
+            ... )
+            >>> g(x=3)["total"]
+            10
+
+        Returns
+        -------
+            out : Callable[..., Dict[str, Any]]
+    """
+
+    def __init__(self, executor: Executor = None):
+        self.executor = executor
+        self.nodes = {}
+
+    def node(self, name: str, function: Callable, *dependencies: str) -> graph:
+
+        """
+            Adds node `name` computed as function(*dependencies).
+            Returns the graph itself such that calls can be chained.
+        """
+
+        if name in self.nodes:
+            raise ValueError(f"node {name!r} already exists")
+
+        self.nodes[name] = (function, dependencies)
+        return self
+
+    def order(self) -> list:
+
+        """
+            Returns node names in an order where each node comes after
+            all of its dependencies. Raises ValueError if the graph has a cycle.
+        """
+
+        order = []
+        state = {}
+        for root in self.nodes:
+            if state.get(root) == "done":
+                continue
+            state[root] = "visiting"
+            stack = [(root, iter(self.nodes[root][1]))]
+            while stack:
+                name, dependencies = stack[-1]
+                for dependency in dependencies:
+                    if dependency not in self.nodes or state.get(dependency) == "done":
+                        continue
+                    if state.get(dependency) == "visiting":
+                        raise ValueError(f"graph has a cycle through node {dependency!r}")
+                    state[dependency] = "visiting"
+                    stack.append((dependency, iter(self.nodes[dependency][1])))
+                    break
+                else:
+                    stack.pop()
+                    state[name] = "done"
+                    order.append(name)
+        return order
+
+    def inputs(self) -> set:
+
+        """
+            Returns the names of all dependencies not being nodes.
+        """
+
+        return {
+            dependency
+            for _, dependencies in self.nodes.values()
+            for dependency in dependencies
+            if dependency not in self.nodes
+        }
+
+    def run(self, inputs: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, float]]:
+
+        """
+            Evaluates all nodes from `inputs`. Returns a tuple of the result
+            of each node and the time in seconds each node took to compute.
+        """
+
+        missing = self.inputs().difference(inputs)
+        if missing:
+            raise ValueError(f"missing graph inputs: {sorted(missing)}")
+        clashing = set(self.nodes).intersection(inputs)
+        if clashing:
+            raise ValueError(f"graph inputs clash with nodes of the same name: {sorted(clashing)}")
+
+        order = self.order()
+        values = dict(inputs)
+        results = {}
+        timings = {}
+
+        def done(name, outcome):
+            values[name], timings[name] = outcome
+            results[name] = values[name]
+
+        if self.executor is None:
+            for name in order:
+                function, dependencies = self.nodes[name]
+                done(name, _timed(function, tuple(map(values.__getitem__, dependencies))))
+            return results, timings
+
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        waiting = {
+            name: set(filter(self.nodes.__contains__, self.nodes[name][1]))
+            for name in order
+        }
+        dependents = {name: [] for name in order}
+        for name, dependencies in waiting.items():
+            for dependency in dependencies:
+                dependents[dependency].append(name)
+
+        running = {}
+
+        def submit(name):
+            function, dependencies = self.nodes[name]
+            future = self.executor.submit(_timed, function, tuple(map(values.__getitem__, dependencies)))
+            running[future] = name
+
+        try:
+            for name in order:
+                if not waiting[name]:
+                    submit(name)
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    done(name, future.result())
+                    for dependent in dependents[name]:
+                        waiting[dependent].discard(name)
+                        if not waiting[dependent]:
+                            submit(dependent)
+        finally:
+            for future in running:
+                future.cancel()
+
+        return results, timings
+
+    def __call__(self, /, **inputs) -> Dict[str, Any]:
+        return self.run(inputs)[0]
@@ -1,5 +1,7 @@
-from typing import Dict, Iterable, Any, FrozenSet
+from __future__ import annotations
+
 from itertools import starmap, groupby, repeat, chain
+from typing import Dict, Iterable, Any, FrozenSet, Sequence
 
 def reverse_otm_dict(data: Dict[Any, Iterable[Any]]) -> Dict[Any, FrozenSet[Any]]:
 
@@ -48,8 +50,113 @@ def reverse_otm_dict(data: Dict[Any, Iterable[Any]]) -> Dict[Any, FrozenSet[Any]
                             data.items(),
                         )
                     ),
+                    # sort on values only, keys need not be comparable
+                    key=lambda x: x[0],
                 ),
                 key=lambda x: x[0],
             )
         )
     )
+
+def reverse_otm_columns(keys: Sequence[Any], values: Sequence[Any], as_dict: bool = False):
+
+    """
+        Reverses a one-to-many relationship given as two parallel columns,
+        where row i relates keys[i] to values[i], without first building
+        a dictionary of lists. Columns may be lists, NumPy arrays or any
+        object supporting the buffer protocol (e.g. `array.array`).
+
+        The result is in CSR-style: `unique_values` holds each distinct value
+        in sorted order and the rows relating to unique_values[j] are
+        indices[offsets[j]:offsets[j+1]], in increasing order. If NumPy is
+        installed and `values` is a NumPy array, buffer or array-like (e.g. a
+        pandas Series) of numbers, grouping is vectorized and the arrays
+        returned are NumPy arrays, else they are lists. Keys are never converted.
+
+        Example:
+            keys   = ["a", "a", "b", "b"]
+            values = [1,   2,   2,   3]
+            =>
+            unique_values = [1, 2, 3]
+            offsets       = [0, 1, 3, 4]
+            indices       = [0, 1, 2, 3]
+
+        Args:
+            keys: Column of keys.
+            values: Column of values, parallel to `keys`.
+            as_dict: If true, return a dictionary equal to what `reverse_otm_dict` returns.
+
+        Returns:
+            Tuple (unique_values, offsets, indices), or a reversed dictionary if `as_dict`.
+    """
+
+    if len(keys) != len(values):
+        raise ValueError(f"`keys` and `values` must have equal length, got {len(keys)} and {len(values)}")
+
+    values_array = _numeric_array(values)
+    if values_array is None:
+        keys, values = _column(keys), _column(values)
+        indices = sorted(range(len(values)), key=values.__getitem__)
+        unique_values, offsets = [], [0]
+        for value, group in groupby(indices, key=values.__getitem__):
+            unique_values.append(value)
+            offsets.append(offsets[-1] + sum(1 for _ in group))
+        if as_dict:
+            return {
+                value: frozenset(map(keys.__getitem__, indices[offsets[j]:offsets[j+1]]))
+                for j, value in enumerate(unique_values)
+            }
+        return unique_values, offsets, indices
+
+    import numpy
+
+    indices = numpy.argsort(values_array, kind="stable")
+    sorted_values = values_array[indices]
+    starts = numpy.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1
+    offsets = numpy.concatenate(([0], starts, [len(indices)])) if len(indices) else numpy.zeros(1, dtype=numpy.intp)
+    unique_values = sorted_values[offsets[:-1]]
+    if as_dict:
+        # keys are taken from the original column, never converted by NumPy
+        if isinstance(keys, numpy.ndarray):
+            grouped = keys[indices].tolist()
+        else:
+            keys = _column(keys)
+            grouped = [keys[i] for i in indices.tolist()]
+        offsets = offsets.tolist()
+        return {
+            value: frozenset(grouped[offsets[j]:offsets[j+1]])
+            for j, value in enumerate(unique_values.tolist())
+        }
+    return unique_values, offsets, indices
+
+def _numeric_array(column: Sequence[Any]):
+
+    """
+        Returns `column` as a NumPy array if NumPy is installed and `column`
+        already is an array, buffer or array-like (implementing `__array__`)
+        of numbers, else None. Other columns
+        (e.g. lists) are never converted, since NumPy may change their items.
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    if not isinstance(column, numpy.ndarray):
+        # e.g. pandas Series and Arrow arrays implement `__array__`
+        if not hasattr(column, "__array__"):
+            try:
+                memoryview(column)
+            except TypeError:
+                return None
+        column = numpy.asarray(column)
+    return column if column.dtype.kind in "biuf" else None
+
+def _column(column: Sequence[Any]) -> Sequence[Any]:
+    if isinstance(column, (list, tuple)):
+        return column
+    try:
+        return memoryview(column).tolist()
+    except TypeError:
+        return list(column)
@@ -53,6 +53,40 @@ def test_sorted_pos():
     maz.sorted_pos(lst, operator.itemgetter(0)) == [[1, 0], [2, 1], [3, 0]]
 
 
+def test_merge_sorted():
+    assert list(maz.merge_sorted([[1, 3, 5], [2, 4], []])) == [1, 2, 3, 4, 5]
+    assert list(maz.merge_sorted([[(1, "a")], [(0, "b")]], operator.itemgetter(0))) == [(0, "b"), (1, "a")]
+
+    merging = maz.compose(list, maz.merge_sorted)
+    assert merging([iter(range(0, 10, 2)), iter(range(1, 10, 2))]) == list(range(10))
+
+
+def test_topk():
+    assert maz.topk([5, 1, 4, 2], 2) == [1, 2]
+    assert maz.topk([5, 1, 4, 2], 2, reverse=True) == [5, 4]
+    assert maz.topk([], 3) == []
+    assert maz.topk([[2, "a"], [1, "b"]], 1, operator.itemgetter(0)) == [[1, "b"]]
+
+
+def test_external_sorted():
+    import random
+    items = [(random.randint(0, 20), i) for i in range(1000)]
+    key = operator.itemgetter(0)
+    for buffer_size in [1, 7, 100, 1000, 5000]:
+        assert list(maz.external_sorted(iter(items), key, buffer_size)) == sorted(items, key=key)
+    assert list(maz.external_sorted([])) == []
+
+    # raised on call, not first on iteration
+    with pytest.raises(ValueError):
+        maz.external_sorted([1], buffer_size=0)
+    with pytest.raises(ValueError):
+        maz.external_sorted([1], fan_in=1)
+
+    # many runs merged through few open files
+    for fan_in in [2, 3, 64]:
+        assert list(maz.external_sorted(iter(items), key, 2, fan_in)) == sorted(items, key=key)
+
+
 def test_compose_pair():
 
     def f(a, b):
@@ -124,6 +158,19 @@ def test_filter_concat():
     ]
     assert actual == expected
 
+def test_filter_concat_is_eager():
+
+    # errors are raised when called, such that wrappers like fnexcept catch them
+    fn = maz.compose(
+        list,
+        maz.fnexcept(
+            maz.filter_map_concat(lambda x: 1/x > 0),
+            maz.constant([]),
+        ),
+    )
+    assert fn([1, 0, 2]) == []
+    assert fn([1, 2]) == [1, 2]
+
 def test_ifttt_function():
 
     class Var:
@@ -182,6 +229,56 @@ def test_partialpos():
     with pytest.raises(Exception):
         assert maz.partialpos(f, {1:2})()
 
+def test_partialpos_template():
+
+    def f(a,b,c,d=1):
+        return 1*a + 2*b + 3*c + 4*d
+
+    template = maz.partialpos.template(f, [1, 2])
+    for b, c in [(2, 2), (5, 7)]:
+        expected = maz.partialpos(f, {1: b, 2: c})
+        assert template(b, c)(1) == expected(1)
+        assert template(b, c)(1, 2) == expected(1, 2)
+        assert template(b, c)(1, d=5) == expected(1, d=5)
+
+    values = [(2, 2), (5, 7), (0, 0)]
+    assert template.apply_many(values, 1) == [maz.partialpos(f, {1: b, 2: c})(1) for b, c in values]
+    assert template.apply_many(values, 1, 3) == [maz.partialpos(f, {1: b, 2: c})(1, 3) for b, c in values]
+    assert template.apply_many(values, 1, c=9) == [maz.partialpos(f, {1: b, 2: c})(1, c=9) for b, c in values]
+    assert template.apply_many([], 1) == []
+
+    # bound instances share the analysis of `f`
+    assert template(1, 2)._plan is template(3, 4)._plan
+
+    with pytest.raises(ValueError):
+        template(1)
+
+def test_partialpos_object():
+
+    import weakref
+
+    def f(a,b,c=0):
+        return (a, b, c)
+
+    fn = maz.partialpos(f, {1: 2})
+    assert weakref.ref(fn)() is fn
+    functools.update_wrapper(fn, f)
+    assert fn.__name__ == "f"
+
+    # changing bound positions after a call is reflected in later calls
+    assert fn(1) == (1, 2, 0)
+    fn.positional_arguments[2] = 3
+    assert fn(1) == (1, 2, 3)
+    fn.positional_arguments = {0: 5}
+    assert fn(1, 2) == (5, 1, 2)
+
+    # as is replacing the function
+    def g(x, y, z=7, w=8):
+        return (x, y, z, w)
+
+    fn.function = g
+    assert fn(1, 2) == (5, 1, 2, 8)
+
 def test_starfilter():
 
     assert list(
@@ -197,3 +294,63 @@ def test_constant():
     assert cnst_fn(0) == True
     assert cnst_fn("hello") == True
     assert cnst_fn(lambda x: x+1) == True
+
+def test_lazy_import():
+
+    import subprocess
+    import sys
+
+    code = (
+        "import sys\n"
+        "import maz\n"
+        "assert 'inspect' not in sys.modules\n"
+        "assert 'maz.compositions' not in sys.modules\n"
+        "assert 'maz.tools' not in sys.modules\n"
+        "assert maz.tools.reverse_otm_dict({'a': [1]}) == {1: {'a'}}\n"
+        "assert 'maz.tools' in sys.modules\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    with pytest.raises(AttributeError):
+        maz.does_not_exist
+
+def test_concurrent_combinators():
+
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    def add(x, y, z=3):
+        return x + 2*y + 3*z
+
+    pipeline = maz.compose(
+        list,
+        maz.filter_map_concat(lambda x: x % 2 == 0, lambda x: -x, maz.partialpos(add, {1: 1})),
+    )
+    cache = {}
+    calls = []
+    barrier = threading.Barrier(64)
+
+    def work(i):
+        barrier.wait()
+        items = range(i, i + 100)
+        assert pipeline(iter(items)) == [-x if x % 2 == 0 else add(x, 1) for x in items]
+        _, value = maz.cached_execution(cache, "key", lambda: calls.append(i) or i)
+        return value
+
+    with ThreadPoolExecutor(64) as executor:
+        values = list(executor.map(work, range(64)))
+
+    # every caller sees the single value that ended up in the cache
+    assert set(values) == {cache["key"]}
+
+def test_type_hints():
+
+    import typing
+
+    assert typing.get_type_hints(maz.cached_execution)["function"] is typing.Callable
+    assert "TYPE_CHECKING" not in dir(maz)
@@ -1,6 +1,8 @@
 import time
+import pytest
 from functools import partial
-from maz.compositions import retry_until, waiting
+import maz
+from maz.compositions import retry_until, waiting, persistent_cache, named, profile
 
 def test_retryer():
 
@@ -36,4 +38,346 @@ def test_timeout():
     start_time = time.time()
     assert waiting_fn(3) == 4
     total_time = time.time()-start_time
-    assert total_time > 1
\ No newline at end of file
+    assert total_time > 1
+
+def test_persistent_cache(tmp_path):
+
+    calls = []
+    def inc(x):
+        calls.append(x)
+        return x+1
+
+    path = str(tmp_path / "cache.db")
+    cached_fn = persistent_cache(inc, path, version="1")
+    assert cached_fn(1) == 2
+    assert cached_fn(1) == 2
+    assert calls == [1]
+    cached_fn.close()
+
+    # results survive between instances with equal version...
+    cached_fn = persistent_cache(inc, path, version="1")
+    assert cached_fn(1) == 2
+    assert calls == [1]
+    assert list(cached_fn.map([1, 2, 2, 3])) == [2, 3, 3, 4]
+    assert calls == [1, 2, 3]
+    cached_fn.close()
+
+    # ...but not with a new version
+    cached_fn = persistent_cache(inc, path, version="2")
+    cached_fn.warm([1])
+    assert calls == [1, 2, 3, 1]
+    cached_fn.clear()
+    assert len(cached_fn) == 0
+
+def test_persistent_cache_eviction(tmp_path):
+
+    cached_fn = persistent_cache(lambda x: x*2, str(tmp_path / "cache.db"), max_entries=2)
+    for i in range(5):
+        assert cached_fn(i) == i*2
+    assert len(cached_fn) == 2
+    assert cached_fn.key(4) != cached_fn.key(3)
+    assert cached_fn.key(1, a=2, b=3) == cached_fn.key(1, b=3, a=2)
+
+    with pytest.raises(ValueError):
+        persistent_cache(lambda x: x, str(tmp_path / "other.db"), max_entries=0)
+
+def test_persistent_cache_concurrent(tmp_path):
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    cached_fn = persistent_cache(lambda x: x*2, str(tmp_path / "cache.db"), max_entries=50)
+    with ThreadPoolExecutor(32) as executor:
+        assert list(executor.map(cached_fn, [i % 100 for i in range(2000)])) == [(i % 100)*2 for i in range(2000)]
+        assert all(executor.map(lambda xs: list(cached_fn.map(xs)) == [x*2 for x in xs], [range(i, i+20) for i in range(100)]))
+    assert len(cached_fn) <= 50
+
+
+def test_named():
+
+    inc = named("inc", lambda x, y=1: x+y)
+    assert inc.name == "inc"
+    assert inc(1) == 2
+    assert inc(1, y=2) == 3
+
+    def fail(x):
+        raise KeyError(x)
+
+    with pytest.raises(KeyError) as info:
+        named("outer", named("fail", fail))(1)
+    assert info.value.__notes__ == ["raised in maz stage 'fail'", "raised in maz stage 'outer'"]
+
+def test_named_compose(monkeypatch):
+
+    inc = named("inc", lambda x: x+1)
+    double = named("double", lambda x: x*2)
+
+    # labels are dropped unless instrumenting
+    composed = maz.compose(inc, double)
+    assert composed.functions == (inc.function, double.function)
+    assert profile(composed)(3) == (7, [])
+
+    monkeypatch.setattr(maz, "instrumentation", True)
+    composed = maz.compose(inc, double)
+    assert composed.functions == (inc, double)
+    result, stages = profile(composed)(3)
+    assert result == 7
+    assert [name for name, _ in stages] == ["double", "inc"]
+    assert all(seconds >= 0 for _, seconds in stages)
+
+def test_sampled():
+
+    from maz.compositions import sampled
+
+    def inc(x):
+        return x+1
+
+    def slow(x):
+        time.sleep(x / 50)
+        return x
+
+    pipeline = maz.compose(
+        inc,
+        maz.ifttt(lambda x: x > 2, slow, named("neg", lambda x: -x)),
+    )
+    fn = sampled(pipeline, rate=1.0, capacity=2, max_repr=20)
+    inputs = [0, 1, 2, 3, 6, 9]
+    assert [fn(x) for x in inputs] == [pipeline(x) for x in inputs]
+
+    # calls of 0.12 and 0.18 seconds are kept, far apart from the rest
+    slowest = {record["args"]: record for record in fn.slowest()}
+    assert set(slowest) == {"(6,)", "(9,)"}
+    assert slowest["(9,)"]["seconds"] >= 0.18
+    labels = [label for label, _ in slowest["(9,)"]["stages"]]
+    assert labels == [
+        "compose/1:ifttt/if:<lambda>",
+        "compose/1:ifttt/then:slow",
+        "compose/1:ifttt",
+        "compose/0:inc",
+        "compose",
+    ]
+
+    fn.clear()
+    assert fn.slowest() == []
+
+    with pytest.raises(TypeError):
+        fn("x" * 100)
+    [record] = fn.slowest()
+    assert record["error"].startswith("TypeError")
+    assert len(record["args"]) <= 20
+
+    # unsampled calls run the plain function
+    fn = sampled(pipeline, rate=0.0)
+    assert fn(1) == 0
+    assert fn.slowest() == []
+
+    with pytest.raises(ValueError):
+        sampled(pipeline, rate=2)
+
+def test_retry_stream():
+
+    from maz.compositions import retry_stream
+
+    def flaky(start=0, fail_at=(3, 7)):
+        for i in range(start, 10):
+            if i in fail_at and not failed.get(i):
+                failed[i] = True
+                raise ConnectionError(i)
+            yield i
+
+    failed = {}
+    reports = []
+    fn = retry_stream(flaky, resume=lambda position: flaky(position), backoff=0.01, report=lambda n, s: reports.append(n))
+    assert list(fn()) == list(range(10))
+    assert reports == [10]
+
+    # without `resume`, the stream is restarted and already yielded items are skipped
+    failed = {}
+    assert list(retry_stream(flaky, backoff=0.01)()) == list(range(10))
+
+    # giving up after `retries` failed attempts in a row
+    def broken():
+        yield from range(5)
+        raise ConnectionError()
+
+    items = []
+    with pytest.raises(ConnectionError):
+        for item in retry_stream(broken, retries=2, backoff=0.01)():
+            items.append(item)
+    assert items == list(range(5))
+
+def test_retry_stream_timeout():
+
+    from maz.compositions import retry_stream
+
+    def slow(start=0):
+        for i in range(start, 5):
+            if i == 2 and start == 0:
+                time.sleep(1)
+            yield i
+
+    fn = retry_stream(slow, resume=lambda position: slow(position), backoff=0.01, item_timeout=0.2)
+    assert list(fn()) == list(range(5))
+
+    fn = retry_stream(lambda: slow(), backoff=0.01, item_timeout=0.2, timeout=0.5)
+    with pytest.raises(TimeoutError):
+        list(fn())
+
+def test_persistent_cache_key(tmp_path):
+
+    import os
+    import subprocess
+    import sys
+
+    code = (
+        "import sys\n"
+        "from maz.compositions import persistent_cache\n"
+        "cached_fn = persistent_cache(len, sys.argv[1])\n"
+        "print(cached_fn.key(frozenset({'alpha', 'beta', 'gamma', 'delta'}), {'b': 2, 'a': {'x', 'y'}}))\n"
+    )
+    keys = {
+        subprocess.run(
+            [sys.executable, "-c", code, str(tmp_path / "cache.db")],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONHASHSEED": seed},
+            check=True,
+        ).stdout
+        for seed in ["1", "2", "3"]
+    }
+    assert len(keys) == 1
+
+    cached_fn = persistent_cache(len, str(tmp_path / "cache.db"))
+    assert cached_fn.key({"a": 1, "b": 2}) == cached_fn.key({"b": 2, "a": 1})
+    assert cached_fn.key([1, 2]) != cached_fn.key((1, 2))
+    assert len({cached_fn.key(1), cached_fn.key(1.0), cached_fn.key(True)}) == 3
+
+def test_persistent_cache_lru(tmp_path):
+
+    calls = []
+    def inc(x):
+        calls.append(x)
+        return x+1
+
+    cached_fn = persistent_cache(inc, str(tmp_path / "cache.db"), max_entries=2)
+    cached_fn(1)
+    time.sleep(0.01)
+    cached_fn(2)
+    time.sleep(0.01)
+    # the access time of a hit is buffered but still counts when evicting
+    cached_fn(1)
+    time.sleep(0.01)
+    cached_fn(3)
+    cached_fn(1)
+    assert calls == [1, 2, 3]
+    cached_fn(2)
+    assert calls == [1, 2, 3, 2]
+    cached_fn.close()
+
+def test_retry_stream_hanging_source():
+
+    import subprocess
+    import sys
+
+    # a hanging source neither keeps the process alive nor escapes the timeout when skipping
+    code = (
+        "import time\n"
+        "from maz.compositions import retry_stream\n"
+        "def source():\n"
+        "    yield 0\n"
+        "    time.sleep(60)\n"
+        "fn = retry_stream(source, backoff=0.01, timeout=0.3)\n"
+        "start = time.perf_counter()\n"
+        "try:\n"
+        "    list(fn())\n"
+        "except TimeoutError:\n"
+        "    pass\n"
+        "assert time.perf_counter() - start < 2\n"
+        "opened = []\n"
+        "def flaky():\n"
+        "    opened.append(1)\n"
+        "    if len(opened) > 1:\n"
+        "        time.sleep(60)\n"
+        "    yield from [0, 1]\n"
+        "    raise ConnectionError()\n"
+        "fn = retry_stream(flaky, backoff=0.01, timeout=0.3)\n"
+        "start = time.perf_counter()\n"
+        "try:\n"
+        "    list(fn())\n"
+        "except TimeoutError:\n"
+        "    pass\n"
+        "assert time.perf_counter() - start < 2\n"
+    )
+    start = time.time()
+    subprocess.run([sys.executable, "-c", code], check=True, timeout=30)
+    assert time.time() - start < 10
+
+def test_persistent_cache_thread_churn(tmp_path):
+
+    import os
+    import threading
+
+    def open_files():
+        return len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else 0
+
+    cached_fn = persistent_cache(lambda x: x*2, str(tmp_path / "cache.db"))
+    before = open_files()
+    for i in range(300):
+        thread = threading.Thread(target=cached_fn, args=(i % 10,))
+        thread.start()
+        thread.join()
+
+    # connections are pooled, not kept per thread ever having called the cache
+    assert len(cached_fn.idle) <= cached_fn.pool_size
+    assert open_files() - before <= 3 * cached_fn.pool_size
+    cached_fn.close()
+    assert cached_fn.idle == []
+    with pytest.raises(ValueError):
+        cached_fn(1)
+
+def test_retry_stream_closes_sources():
+
+    from maz.compositions import retry_stream
+
+    opened, closed = [], []
+
+    class Source:
+        # an iterator holding a resource, failing at item 3 on the first attempt
+        def __init__(self, start):
+            opened.append(start)
+            self.start = start
+            self.i = start
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            if self.i == 3 and self.start == 0:
+                raise ConnectionError()
+            if self.i == 6:
+                raise StopIteration()
+            self.i += 1
+            return self.i - 1
+
+        def close(self):
+            closed.append(self.start)
+
+    source = lambda start=0: Source(start)
+
+    reports = []
+    for item_timeout in [None, 1.0]:
+        opened.clear(), closed.clear(), reports.clear()
+        fn = retry_stream(
+            source,
+            resume=lambda position: source(position),
+            backoff=0.01,
+            item_timeout=item_timeout,
+            report=lambda n, s: reports.append(n),
+        )
+        stream = fn()
+        assert [next(stream) for _ in range(5)] == [0, 1, 2, 3, 4]
+        # the failed source was closed before resuming
+        assert opened == [0, 3] and closed == [0]
+        stream.close()
+        assert closed == [0, 3]
+        # all five items taken were delivered
+        assert reports == [5]
@@ -0,0 +1,66 @@
+import operator
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from maz.graph import graph
+
+def build(executor=None):
+    return (
+        graph(executor)
+        .node("total", operator.add, "double", "inc")
+        .node("double", operator.mul, "x", "two")
+        .node("inc", lambda x: x+1, "x")
+        .node("two", lambda: 2)
+    )
+
+def test_graph():
+
+    g = build()
+    assert g.inputs() == {"x"}
+    order = g.order()
+    assert order.index("total") > order.index("double") > order.index("two")
+    assert order.index("total") > order.index("inc")
+    assert g(x=3) == {"total": 10, "double": 6, "inc": 4, "two": 2}
+
+    results, timings = g.run({"x": 3})
+    assert results["total"] == 10
+    assert set(timings) == {"total", "double", "inc", "two"}
+    assert all(t >= 0 for t in timings.values())
+
+    with pytest.raises(ValueError):
+        g()
+
+    # inputs can't be named as nodes, but may be named anything else
+    with pytest.raises(ValueError):
+        g(x=3, inc=5)
+    assert graph().node("out", lambda x: x, "self")(self=1) == {"out": 1}
+
+    with pytest.raises(ValueError):
+        g.node("inc", lambda x: x, "x")
+
+    with pytest.raises(ValueError):
+        graph().node("a", lambda x: x, "b").node("b", lambda x: x, "a").order()
+
+def test_graph_executor():
+
+    with ThreadPoolExecutor(4) as executor:
+        assert build(executor)(x=3)["total"] == 10
+
+        # independent nodes run concurrently: each waits for all to start
+        barrier = threading.Barrier(3, timeout=5)
+        def one():
+            barrier.wait()
+            return 1
+
+        g = graph(executor).node("all", lambda *xs: sum(xs), "a", "b", "c")
+        for name in "abc":
+            g.node(name, one)
+        assert g()["all"] == 3
+
+        g = graph(executor).node("a", lambda: 1/0).node("b", lambda a: a, "a")
+        with pytest.raises(ZeroDivisionError):
+            g()
+
+    with ProcessPoolExecutor(2) as executor:
+        g = graph(executor).node("sum", operator.add, "x", "y").node("neg", operator.neg, "sum")
+        assert g(x=1, y=2) == {"sum": 3, "neg": -3}
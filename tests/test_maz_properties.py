@@ -0,0 +1,153 @@
+import functools
+import itertools
+import operator
+import pytest
+import maz
+
+pytest.importorskip("hypothesis")
+
+from hypothesis import assume, example, given, strategies as st
+from maz.compositions import sampled
+from maz.tools import reverse_otm_dict, reverse_otm_columns
+
+# Property based tests cross-checking maz against straightforward
+# reference implementations on generated functions and inputs.
+
+unary = st.sampled_from([
+    lambda x: x + 1,
+    lambda x: x * 2,
+    lambda x: -x,
+    lambda x: x % 7,
+    abs,
+])
+
+predicates = st.sampled_from([
+    lambda x: x > 0,
+    lambda x: x % 2 == 0,
+    lambda x: x % 3 == 1,
+    bool,
+    maz.constant(True),
+    maz.constant(False),
+])
+
+def make_function(n_params: int, n_defaults: int):
+
+    """
+        Returns a function with `n_params` parameters, the last `n_defaults`
+        having default values, returning all arguments as they were received.
+    """
+
+    params = [f"p{i}" if i < n_params - n_defaults else f"p{i}={-i}" for i in range(n_params)]
+    names = [f"p{i}" for i in range(n_params)]
+    # a local variable, since partialpos looks at all of `co_varnames`
+    source = f"def f({', '.join(params)}):\n    local = 0\n    return ({', '.join(names)},)"
+    scope = {}
+    exec(source, scope)
+    return scope["f"]
+
+@st.composite
+def partialpos_cases(draw):
+
+    """
+        Draws a function together with bound positions, positional and keyword
+        arguments, such that every parameter without default gets a value.
+    """
+
+    n_params = draw(st.integers(1, 5))
+    n_defaults = draw(st.integers(0, n_params))
+    f = make_function(n_params, n_defaults)
+    required = n_params - n_defaults
+
+    bound = sorted(draw(st.sets(st.integers(0, n_params - 1))))
+    free = [i for i in range(n_params) if i not in bound]
+    n_args = draw(st.integers(0, len(free)))
+    kwargs = {f"p{i}": draw(st.integers()) for i in free[n_args:] if draw(st.booleans())}
+    # every parameter without default must get a value
+    assume(all(i in bound or i in free[:n_args] or f"p{i}" in kwargs for i in range(required)))
+
+    values = draw(st.lists(st.tuples(*[st.integers()] * len(bound)), max_size=5))
+    args = draw(st.lists(st.integers(), min_size=n_args, max_size=n_args))
+    return f, bound, values, args, kwargs
+
+def reference_partialpos(f, bound: dict, args: list, kwargs: dict):
+    names = f.__code__.co_varnames[:f.__code__.co_argcount]
+    free = [name for i, name in enumerate(names) if i not in bound]
+    call = {names[i]: v for i, v in bound.items()}
+    call.update(kwargs)
+    call.update(zip(free, args))
+    return f(**call)
+
+@given(partialpos_cases())
+def test_partialpos_matches_reference(case):
+    f, positions, values, args, kwargs = case
+    template = maz.partialpos.template(f, positions)
+    expected = [
+        reference_partialpos(f, dict(zip(positions, value)), args, kwargs)
+        for value in values
+    ]
+    assert [maz.partialpos(f, dict(zip(positions, value)))(*args, **kwargs) for value in values] == expected
+    assert [template(*value)(*args, **kwargs) for value in values] == expected
+    assert template.apply_many(values, *args, **kwargs) == expected
+
+@given(st.lists(unary, min_size=1, max_size=6), st.integers())
+def test_compose_matches_reference(functions, x):
+    expected = x
+    for fn in reversed(functions):
+        expected = fn(expected)
+    assert maz.compose(*functions)(x) == expected
+    assert functools.reduce(maz.compose_pair, functions)(x) == expected
+
+@given(predicates, unary, unary, st.lists(st.integers()))
+def test_filter_map_concat_matches_reference(predicate, tmap, fmap, xs):
+    expected = [tmap(x) if predicate(x) else fmap(x) for x in xs]
+    assert list(maz.filter_map_concat(predicate, tmap, fmap)(iter(xs))) == expected
+    assert list(maz.filter_map_concat(predicate)(xs)) == xs
+
+otm_keys = st.one_of(st.text(max_size=3), st.integers(-5, 5), st.none())
+
+@given(st.dictionaries(otm_keys, st.lists(st.integers(0, 20))))
+@example({"\x00": [0]})
+@example({"a": [1], 1: [1, 2]})
+def test_reverse_otm_matches_reference(data):
+    expected = {}
+    for key, values in data.items():
+        for value in values:
+            expected.setdefault(value, set()).add(key)
+    assert reverse_otm_dict(data) == expected
+
+    keys = [key for key, values in data.items() for _ in values]
+    values = [value for vs in data.values() for value in vs]
+    assert reverse_otm_columns(keys, values, as_dict=True) == expected
+    unique_values, offsets, indices = map(list, reverse_otm_columns(keys, values))
+    assert unique_values == sorted(expected)
+    for j, value in enumerate(unique_values):
+        rows = indices[offsets[j]:offsets[j+1]]
+        assert rows == sorted(rows)
+        assert all(values[i] == value for i in rows)
+        assert {keys[i] for i in rows} == expected[value]
+
+    try:
+        import numpy
+    except ImportError:
+        return
+    # the vectorized path, taken for numeric arrays of values
+    assert reverse_otm_columns(keys, numpy.array(values, dtype=numpy.int64), as_dict=True) == expected
+
+@given(st.lists(st.tuples(st.integers(0, 5), st.integers())), st.integers(1, 10), st.booleans())
+def test_sorting_matches_reference(items, k, reverse):
+    key = operator.itemgetter(0)
+    expected = sorted(items, key=key)
+    assert list(maz.external_sorted(iter(items), key, buffer_size=k)) == expected
+    assert maz.topk(items, k, key, reverse) == sorted(items, key=key, reverse=reverse)[:k]
+
+    runs = [sorted(items[i::3], key=key) for i in range(3)]
+    assert list(maz.merge_sorted(runs, key)) == sorted(itertools.chain(*runs), key=key)
+
+@given(predicates, unary, unary, unary, st.integers())
+def test_sampled_matches_reference(predicate, f, g, h, x):
+    pipeline = maz.compose(
+        f,
+        maz.ifttt(predicate, g, h),
+        maz.fnexcept(lambda x: 1 // x, maz.constant(0)),
+    )
+    assert sampled(pipeline, rate=1.0)(x) == pipeline(x)
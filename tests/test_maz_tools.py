@@ -1,4 +1,6 @@
-from maz.tools import reverse_otm_dict
+import array
+import pytest
+from maz.tools import reverse_otm_dict, reverse_otm_columns
 
 def test_reverse_otm_dict():
     d = {
@@ -14,4 +16,68 @@ def test_reverse_otm_dict():
         4: frozenset({"b", "c"}),
         5: frozenset({"c"}),
     }
-    assert actual == expected
\ No newline at end of file
+    assert actual == expected
+
+def test_reverse_otm_columns():
+    d = {
+        "a": [1,2,3],
+        "b": [2,3,4],
+        "c": [3,4,5],
+    }
+    keys = [k for k, vs in d.items() for _ in vs]
+    values = [v for vs in d.values() for v in vs]
+
+    assert reverse_otm_columns(keys, values, as_dict=True) == reverse_otm_dict(d)
+    unique_values, offsets, indices = reverse_otm_columns(keys, values)
+    assert list(unique_values) == [1, 2, 3, 4, 5]
+    assert list(offsets) == [0, 1, 3, 6, 8, 9]
+    assert list(indices) == [0, 1, 3, 2, 4, 6, 5, 7, 8]
+
+    assert reverse_otm_columns(
+        array.array("q", [10, 10, 20]),
+        array.array("q", [1, 2, 1]),
+        as_dict=True,
+    ) == {1: frozenset({10, 20}), 2: frozenset({10})}
+    assert reverse_otm_columns([], [], as_dict=True) == {}
+
+    with pytest.raises(ValueError):
+        reverse_otm_columns([1], [])
+
+def test_reverse_otm_columns_numpy():
+    numpy = pytest.importorskip("numpy")
+    keys = numpy.array([0, 0, 1, 2, 2])
+    values = numpy.array([7, 5, 5, 7, 9])
+    unique_values, offsets, indices = reverse_otm_columns(keys, values)
+    assert unique_values.tolist() == [5, 7, 9]
+    assert offsets.tolist() == [0, 2, 4, 5]
+    assert indices.tolist() == [1, 2, 0, 3, 4]
+    assert reverse_otm_columns(keys, values, as_dict=True) == {5: {0, 1}, 7: {0, 2}, 9: {2}}
+
+def test_reverse_otm_columns_keeps_items():
+    # columns not being numeric arrays are never converted
+    assert reverse_otm_columns(["a\x00", "b"], [1, 2], as_dict=True) == {1: {"a\x00"}, 2: {"b"}}
+    assert reverse_otm_columns(["a", 1], [1, 2], as_dict=True) == {1: {"a"}, 2: {1}}
+    d = reverse_otm_columns(["a", "b"], [1.5, 1], as_dict=True)
+    assert d == {1.5: {"a"}, 1: {"b"}}
+    assert [type(value) for value in sorted(d)] == [int, float]
+
+def test_reverse_otm_columns_array_like():
+    numpy = pytest.importorskip("numpy")
+
+    class Column:
+        # only implementing `__array__`, as e.g. pandas Series
+        def __init__(self, data):
+            self.data = data
+
+        def __array__(self, dtype=None, copy=None):
+            return numpy.array(self.data, dtype=dtype)
+
+        def __len__(self):
+            return len(self.data)
+
+    unique_values, offsets, indices = reverse_otm_columns(["a", "b", "c"], Column([2, 1, 2]))
+    assert isinstance(unique_values, numpy.ndarray)
+    assert unique_values.tolist() == [1, 2]
+    assert offsets.tolist() == [0, 1, 3]
+    assert indices.tolist() == [1, 0, 2]
+    assert reverse_otm_columns(["a", "b", "c"], Column([2, 1, 2]), as_dict=True) == {1: {"b"}, 2: {"a", "c"}}